@@ -33,8 +33,11 @@ import re
 import time
 import io
 import gzip
+import json
+import os
+from array import array
 from xml.dom import minidom
-from collections import UserDict
+from collections import UserDict, deque
 import datetime
 
 StringTypes = str
@@ -42,18 +45,21 @@ ListType = list
 TupleType = tuple
 
 PINBOARD_API = "https://api.pinboard.in/v1"
+DOWNLOAD_WINDOW = 1000
+DOWNLOAD_MIN_WINDOW = 100
+DOWNLOAD_MAX_WINDOW = 10000
 AUTH_HANDLER_REALM = "API"
 AUTH_HANDLER_URI = "https://api.pinboard.in/"
 
 
-def open(username=None, password=None, token=None):
+def open(username=None, password=None, token=None, api=None):
     """Open a connection to a pinboard.in account"""
-    return PinboardAccount(username, password, token)
+    return PinboardAccount(username, password, token, api)
 
 
-def connect(username=None, password=None, token=None):
+def connect(username=None, password=None, token=None, api=None):
     """Open a connection to a pinboard.in account (alias for pinboard.open())."""
-    return open(username, password, token)
+    return open(username, password, token, api)
 
 
 class PinboardError(Exception):
@@ -109,16 +115,118 @@ class DateParamsError(PinboardError):
     pass
 
 
+class AccountChangedError(PinboardError):
+    """The pinboard.in account changed while it was being downloaded"""
+
+    pass
+
+
+class TagVocabulary:
+    """Shared mapping between tag names and small integer tag IDs
+
+    Every distinct tag name is stored once; posts hold references to the
+    shared name strings and bundles refer to tags by ID, so the same strings
+    are not allocated over and over again.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def intern(self, name):
+        """Return the ID of a tag name, adding it to the vocabulary if needed"""
+        try:
+            return self.ids[name]
+        except KeyError:
+            tag_id = len(self.names)
+            self.ids[name] = tag_id
+            self.names.append(name)
+            return tag_id
+
+    def lookup(self, name):
+        """Return the ID of a tag name or None if it is not known"""
+        return self.ids.get(name)
+
+    def name(self, tag_id):
+        """Return the (shared) tag name for an ID"""
+        return self.names[tag_id]
+
+    def shared(self, name):
+        """Return the shared string for a tag name, interning it if needed"""
+        return self.names[self.intern(name)]
+
+    def encode(self, names):
+        """Return a compact array of tag IDs for a sequence of tag names"""
+        ids = [self.intern(name) for name in names]
+        if len(self.names) > 0xFFFF:
+            return array("I", ids)
+        return array("H", ids)
+
+    def id_set(self, names):
+        """Return a frozenset of tag IDs for a sequence of tag names"""
+        return frozenset(self.intern(name) for name in names)
+
+    def rename(self, old, new):
+        """Rename a tag in the vocabulary and return the new tag's ID
+
+        If new is already known the two tags are merged: the old ID keeps
+        resolving to the new name, but lookups by name return the existing ID.
+        """
+        tag_id = self.ids.pop(old, None)
+        if tag_id is None:
+            return self.intern(new)
+        if new in self.ids:
+            self.names[tag_id] = self.names[self.ids[new]]
+            return self.ids[new]
+        self.names[tag_id] = new
+        self.ids[new] = tag_id
+        return tag_id
+
+
+class TagList(list):
+    """List of tag names whose strings are shared through a TagVocabulary
+
+    It behaves exactly like a list; ids returns the tags as a compact array
+    of tag IDs.
+    """
+
+    __slots__ = ("vocabulary",)
+
+    def __init__(self, vocabulary, names=()):
+        super().__init__(vocabulary.shared(name) for name in names)
+        self.vocabulary = vocabulary
+
+    @property
+    def ids(self):
+        return self.vocabulary.encode(self)
+
+
 class PinboardAccount(UserDict):
     """A pinboard.in account"""
 
     __allposts = 0
     __postschanged = 0
     __lastrequest = None
+    __lastsize = 0
+    __lastelapsed = 0.0
     __token = None
 
-    def __init__(self, username=None, password=None, token=None):
+    def __init__(self, username=None, password=None, token=None, api=None):
         super().__init__()
+        self.api = api or PINBOARD_API
+        self.tag_vocabulary = TagVocabulary()
+        self.request_stats = {
+            "requests": 0,
+            "throttle_sleeps": 0,
+            "throttle_seconds": 0.0,
+            "throttled": 0,
+        }
         if _debug:
             sys.stderr.write("Initialising Pinboard Account object.\n")
 
@@ -174,12 +282,15 @@ class PinboardAccount(UserDict):
                     "It has been less than two seconds since the last request; halting execution for one second.\n"
                 )
             time.sleep(1)
+            self.request_stats["throttle_sleeps"] += 1
+            self.request_stats["throttle_seconds"] += 1
         if _debug and self.__lastrequest:
             sys.stderr.write(
                 "The delay between requests was %d.\n"
                 % (time.time() - self.__lastrequest)
             )
         self.__lastrequest = time.time()
+        self.request_stats["requests"] += 1
         if _debug:
             sys.stderr.write("Opening %s.\n" % url)
 
@@ -197,6 +308,7 @@ class PinboardAccount(UserDict):
             xml = gzipper.read()
         except urllib.error.URLError as e:
             raise e
+        self.__lastsize = len(xml)
 
         self["headers"] = {}
         for header, value in raw_xml.getheaders():
@@ -205,14 +317,59 @@ class PinboardAccount(UserDict):
             raise ThrottleError(url, "429 HTTP status code returned by pinboard.in")
         if _debug:
             sys.stderr.write("%s opened successfully.\n" % url)
-        return minidom.parseString(xml)
+        dom = minidom.parseString(xml)
+        # Network and parse time only; the throttle sleep happens before
+        # __lastrequest is taken.
+        self.__lastelapsed = time.time() - self.__lastrequest
+        return dom
 
     def last_update(self):
         """Return the last time that the pinboard account was updated."""
-        return self.__request("%s/posts/update" % PINBOARD_API).firstChild.getAttribute(
+        return self.__request("%s/posts/update" % self.api).firstChild.getAttribute(
             "time"
         )
 
+    def update_time(self, etag=None, modified=None):
+        """Cheaply check when the pinboard account was last updated.
+
+        Unlike last_update() this does not wait for the request throttle, build
+        a DOM or store the headers, but it still counts as the latest request
+        so the next throttled request is spaced after it. etag and modified
+        are the validators returned by a previous call and are sent as
+        conditional headers. Returns a tuple of (time, etag, modified); time
+        is None if the server answered 304.
+        """
+        url = "%s/posts/update" % self.api
+        if self.__token:
+            url = "%s?auth_token=%s" % (url, self.__token)
+        req = urllib.request.Request(url)
+        req.add_header("Accept-encoding", "gzip")
+        if etag:
+            req.add_header("If-None-Match", etag)
+        if modified:
+            req.add_header("If-Modified-Since", modified)
+        self.__lastrequest = time.time()
+        self.request_stats["requests"] += 1
+        try:
+            response = urllib.request.urlopen(req)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, etag, modified
+            if e.code == 429:
+                raise ThrottleError(url, "429 HTTP status code returned by pinboard.in")
+            raise
+        data = response.read()
+        if data[:2] == b"\x1f\x8b":
+            data = gzip.decompress(data)
+        match = re.search(rb'time="([^"]*)"', data)
+        if not match:
+            raise PinboardError("Unexpected posts/update response: %r" % data[:100])
+        return (
+            match.group(1).decode("utf-8"),
+            response.headers.get("ETag", etag),
+            response.headers.get("Last-Modified", modified),
+        )
+
     def posts(
         self, tag="", date="", todt="", fromdt="", count=0, offset=0, only_toread=False
     ):
@@ -287,21 +444,14 @@ class PinboardAccount(UserDict):
             query["dt"] = date
 
         postsxml = self.__request(
-            "%s/posts/%s?%s" % (PINBOARD_API, path, urllib.parse.urlencode(query))
+            "%s/posts/%s?%s" % (self.api, path, urllib.parse.urlencode(query))
         ).getElementsByTagName("post")
         posts = []
         if _debug:
             sys.stderr.write("Parsing posts XML into a list of dictionaries.\n")
 
         for post in postsxml:
-            postdict = {}
-            for name, value in post.attributes.items():
-                if name == "tag":
-                    name = "tags"
-                    value = value.split(" ")
-                if name == "time":
-                    postdict["time_parsed"] = time.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
-                postdict[name] = value
+            postdict = self.__post_dict(post)
 
             if (
                 self.has_key("posts")
@@ -330,10 +480,126 @@ class PinboardAccount(UserDict):
         self.__postschanged = 0
         return posts
 
+    def __post_dict(self, post):
+        postdict = {}
+        for name, value in post.attributes.items():
+            if name == "tag":
+                name = "tags"
+                value = TagList(self.tag_vocabulary, value.split(" "))
+            if name == "time":
+                postdict["time_parsed"] = time.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+            postdict[name] = value
+        return postdict
+
+    def paginated_posts(
+        self,
+        checkpoint=None,
+        window=DOWNLOAD_WINDOW,
+        min_window=DOWNLOAD_MIN_WINDOW,
+        max_window=DOWNLOAD_MAX_WINDOW,
+        target_latency=5.0,
+        max_page_bytes=2 * 1024 * 1024,
+        throttle_wait=300,
+        max_retries=5,
+    ):
+        """Yield all pinboard.in bookmarks page by page as lists of dictionaries.
+
+        The collection is walked with start/results windows instead of one
+        posts/all request. If checkpoint is a file name, progress is saved
+        there after each page has been consumed and a later call resumes from
+        it, as long as the account has not been updated in the meantime. The
+        window grows while pages are fast and small and shrinks when they are
+        slow or large. The checkpoint is removed once the download completes.
+
+        posts/update is checked again after the last page; if the account
+        changed during the download the offsets may have shifted, so the
+        checkpoint is removed and AccountChangedError is raised for the caller
+        to start over.
+        """
+        if window < 1 or min_window < 1 or max_window < min_window:
+            raise ValueError("Download windows must be positive numbers of posts")
+
+        last_updated = self.last_update()
+        start = 0
+        if checkpoint and os.path.exists(checkpoint):
+            try:
+                with io.open(checkpoint, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                if state.get("last_updated") == last_updated:
+                    start = int(state["start"])
+                    window = int(state.get("window", window))
+                    window = min(max_window, max(min_window, window))
+                    if _debug:
+                        sys.stderr.write("Resuming download at post %d.\n" % start)
+                elif _debug:
+                    sys.stderr.write("Account updated since checkpoint; restarting.\n")
+            except (ValueError, KeyError, TypeError, AttributeError):
+                start = 0
+                if _debug:
+                    sys.stderr.write("Unreadable checkpoint; restarting.\n")
+
+        retries = 0
+        while True:
+            query = {"start": start, "results": window}
+            try:
+                postsxml = self.__request(
+                    "%s/posts/all?%s" % (self.api, urllib.parse.urlencode(query))
+                ).getElementsByTagName("post")
+            except (ThrottleError, urllib.error.HTTPError) as e:
+                if isinstance(e, urllib.error.HTTPError) and e.code != 429:
+                    raise
+                retries += 1
+                self.request_stats["throttled"] += 1
+                if retries > max_retries:
+                    raise
+                window = max(min_window, window // 2)
+                if _debug:
+                    sys.stderr.write(
+                        "Throttled at post %d; waiting %d seconds.\n"
+                        % (start, throttle_wait)
+                    )
+                time.sleep(throttle_wait)
+                self.request_stats["throttle_seconds"] += throttle_wait
+                continue
+            retries = 0
+            elapsed = self.__lastelapsed
+
+            posts = [self.__post_dict(post) for post in postsxml]
+            if posts:
+                yield posts
+            start += len(posts)
+
+            if len(posts) < window:
+                if checkpoint and os.path.exists(checkpoint):
+                    os.remove(checkpoint)
+                if self.last_update() != last_updated:
+                    raise AccountChangedError(
+                        "pinboard.in account updated while downloading posts"
+                    )
+                if _debug:
+                    sys.stderr.write("Download complete: %d posts.\n" % start)
+                return
+
+            if elapsed > target_latency or self.__lastsize > max_page_bytes:
+                window = max(min_window, window // 2)
+            elif elapsed < target_latency / 2 and self.__lastsize < max_page_bytes / 2:
+                window = min(max_window, window * 2)
+            if _debug:
+                sys.stderr.write(
+                    "Fetched %d posts (%d bytes) in %.2f seconds; next window %d.\n"
+                    % (len(posts), self.__lastsize, elapsed, window)
+                )
+
+            if checkpoint:
+                state = {"start": start, "window": window, "last_updated": last_updated}
+                with io.open(checkpoint + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(checkpoint + ".tmp", checkpoint)
+
     def suggest(self, url):
         query = {"url": url}
         tags = self.__request(
-            "%s/posts/suggest?%s" % (PINBOARD_API, urllib.parse.urlencode(query))
+            "%s/posts/suggest?%s" % (self.api, urllib.parse.urlencode(query))
         )
 
         popular = [t.firstChild.data for t in tags.getElementsByTagName("popular")]
@@ -345,9 +611,7 @@ class PinboardAccount(UserDict):
 
     def tags(self):
         """Return a dictionary of tags with the number of posts in each one"""
-        tagsxml = self.__request("%s/tags/get?" % PINBOARD_API).getElementsByTagName(
-            "tag"
-        )
+        tagsxml = self.__request("%s/tags/get?" % self.api).getElementsByTagName("tag")
         tags = []
         if _debug:
             sys.stderr.write("Parsing tags XML into a list of dictionaries.\n")
@@ -356,6 +620,7 @@ class PinboardAccount(UserDict):
             for name, value in tag.attributes.items():
                 if name == "tag":
                     name = "name"
+                    value = self.tag_vocabulary.shared(value)
                 elif name == "count":
                     value = int(value)
                 tagdict[name] = value
@@ -375,7 +640,7 @@ class PinboardAccount(UserDict):
     def bundles(self):
         """Return a dictionary of all bundles"""
         bundlesxml = self.__request(
-            "%s/tags/bundles/all" % PINBOARD_API
+            "%s/tags/bundles/all" % self.api
         ).getElementsByTagName("bundle")
         bundles = []
         if _debug:
@@ -383,6 +648,8 @@ class PinboardAccount(UserDict):
         for bundle in bundlesxml:
             bundledict = {}
             for name, value in bundle.attributes.items():
+                if name == "tags":
+                    bundledict["tag_ids"] = self.tag_vocabulary.id_set(value.split(" "))
                 bundledict[name] = value
             if (
                 self.has_key("bundles")
@@ -404,7 +671,7 @@ class PinboardAccount(UserDict):
         else:
             query = ""
         datesxml = self.__request(
-            "%s/posts/dates?%s" % (PINBOARD_API, query)
+            "%s/posts/dates?%s" % (self.api, query)
         ).getElementsByTagName("date")
         dates = []
         if _debug:
@@ -473,7 +740,7 @@ class PinboardAccount(UserDict):
             query["dt"] = date
         try:
             response = self.__request(
-                "%s/posts/add?%s" % (PINBOARD_API, urllib.parse.urlencode(query))
+                "%s/posts/add?%s" % (self.api, urllib.parse.urlencode(query))
             )
             if response.firstChild.getAttribute("code") != "done":
                 raise AddError
@@ -497,7 +764,7 @@ class PinboardAccount(UserDict):
             query["tags"] = tags
         try:
             response = self.__request(
-                "%s/tags/bundles/set?%s" % (PINBOARD_API, urllib.parse.urlencode(query))
+                "%s/tags/bundles/set?%s" % (self.api, urllib.parse.urlencode(query))
             )
             if response.firstChild.getAttribute("code") != "done":
                 raise BundleError
@@ -514,8 +781,7 @@ class PinboardAccount(UserDict):
         """Delete post from pinboard.in by its URL"""
         try:
             response = self.__request(
-                "%s/posts/delete?%s"
-                % (PINBOARD_API, urllib.parse.urlencode({"url": url}))
+                "%s/posts/delete?%s" % (self.api, urllib.parse.urlencode({"url": url}))
             )
             if response.firstChild.getAttribute("code") != "done":
                 raise DeleteError
@@ -530,7 +796,7 @@ class PinboardAccount(UserDict):
         try:
             response = self.__request(
                 "%s/tags/bundles/delete?%s"
-                % (PINBOARD_API, urllib.parse.urlencode({"bundle": name}))
+                % (self.api, urllib.parse.urlencode({"bundle": name}))
             )
             if response.firstChild.getAttribute("code") != "done":
                 raise DeleteBundleError
@@ -543,14 +809,20 @@ class PinboardAccount(UserDict):
                 )
 
     def rename_tag(self, old, new):
-        """Rename a tag"""
+        """Rename a tag on pinboard.in and in the cached posts, tags and bundles
+
+        Cached posts hold the tag as a shared string, so every cached post,
+        tag count and bundle using it is rewritten; the cost grows with the
+        size of the cache.
+        """
         query = {"old": old, "new": new}
         try:
             response = self.__request(
-                "%s/tags/rename?%s" % (PINBOARD_API, urllib.parse.urlencode(query))
+                "%s/tags/rename?%s" % (self.api, urllib.parse.urlencode(query))
             )
             if response.firstChild.getAttribute("code") != "done":
                 raise RenameTagError
+            self.__rename_cached_tag(old, new)
             if _debug:
                 sys.stderr.write("Tag, %s, renamed to %s\n" % (old, new))
         except Exception:
@@ -559,12 +831,50 @@ class PinboardAccount(UserDict):
                     "Unable to rename %s tag to %s in pinboard.in\n" % (old, new)
                 )
 
+    def __rename_cached_tag(self, old, new):
+        vocabulary = self.tag_vocabulary
+        new_id = vocabulary.rename(old, new)
+        new = vocabulary.name(new_id)
+
+        posts = self.data.get("posts")
+        if isinstance(posts, ListType):
+            for post in posts:
+                tags = post.get("tags")
+                if tags and old in tags:
+                    renamed = []
+                    for name in tags:
+                        name = new if name == old else name
+                        if name not in renamed:
+                            renamed.append(name)
+                    tags[:] = renamed
+
+        tags = self.data.get("tags")
+        if isinstance(tags, ListType):
+            existing = [tag for tag in tags if tag.get("name") == new]
+            for tag in [tag for tag in tags if tag.get("name") == old]:
+                if existing:
+                    existing[0]["count"] = existing[0].get("count", 0) + tag.get(
+                        "count", 0
+                    )
+                    tags.remove(tag)
+                else:
+                    tag["name"] = new
+
+        bundles = self.data.get("bundles")
+        if isinstance(bundles, ListType):
+            for bundle in bundles:
+                names = bundle.get("tags", "").split(" ")
+                if old in names:
+                    names = [new if name == old else name for name in names]
+                    names = sorted(set(names), key=names.index)
+                    bundle["tags"] = " ".join(names)
+                    bundle["tag_ids"] = vocabulary.id_set(names)
+
     def delete_tag(self, name):
         """Delete a tag from pinboard.in by its name"""
         try:
             response = self.__request(
-                "%s/tags/delete?%s"
-                % (PINBOARD_API, urllib.parse.urlencode({"tag": name}))
+                "%s/tags/delete?%s" % (self.api, urllib.parse.urlencode({"tag": name}))
             )
             if response.firstChild.getAttribute("code") != "done":
                 raise DeleteBundleError
@@ -575,7 +885,578 @@ class PinboardAccount(UserDict):
                 sys.stderr.write("Unable to delete tag, %s, from pinboard.in\n" % name)
 
 
+class UpdatePoller:
+    """Poll a pinboard.in account for updates and report when it changes
+
+    Each check is a single conditional posts/update request made through
+    PinboardAccount.update_time(). At most budget checks are made in any
+    budget_period seconds, independently of the account's request throttle.
+    When the update time moves, every callback is called with the new time
+    and, inside run_async(), the changed asyncio event is set. run_async()
+    runs both the request and the callbacks in the default executor, so a
+    callback that re-syncs does not block the event loop. The new time
+    is only recorded once every callback has succeeded, so a failed callback
+    is retried on the next check.
+    """
+
+    def __init__(
+        self, account, interval=60, callback=None, budget=60, budget_period=3600
+    ):
+        import threading
+
+        self.account = account
+        self.interval = interval
+        self.budget = budget
+        self.budget_period = budget_period
+        self.last_updated = account["last_updated"]
+        self.callbacks = []
+        if callback:
+            self.callbacks.append(callback)
+        self.changed = None
+        self.stopped = threading.Event()
+        self.__etag = None
+        self.__modified = None
+        self.__checks = deque()
+        self.__wake = None
+
+    def add_callback(self, callback):
+        """Call callback(time) whenever the account update time moves"""
+        self.callbacks.append(callback)
+
+    def check(self):
+        """Check for an update now; return True if the account has changed"""
+        return self.__changed(self.__fetch())
+
+    def __fetch(self):
+        now = time.time()
+        while self.__checks and now - self.__checks[0] >= self.budget_period:
+            self.__checks.popleft()
+        if len(self.__checks) >= self.budget:
+            if _debug:
+                sys.stderr.write("Update poller budget spent; skipping check.\n")
+            return None
+        self.__checks.append(now)
+        return self.account.update_time(self.__etag, self.__modified)
+
+    def __changed(self, result):
+        if result is None:
+            return False
+        updated, etag, modified = result
+        if updated is None or updated == self.last_updated:
+            self.__etag, self.__modified = etag, modified
+            return False
+        if _debug:
+            sys.stderr.write(
+                "Account updated: %s -> %s.\n" % (self.last_updated, updated)
+            )
+        for callback in self.callbacks:
+            callback(updated)
+        self.last_updated = updated
+        self.__etag, self.__modified = etag, modified
+        return True
+
+    def stop(self):
+        """Stop run() or run_async(), waking it if it is waiting"""
+        self.stopped.set()
+        if self.__wake is not None:
+            loop, wake = self.__wake
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                # The event loop has already closed.
+                pass
+
+    def run(self):
+        """Check for updates every interval seconds until stop() is called"""
+        self.stopped.clear()
+        while not self.stopped.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                sys.stderr.write("Update check failed: %s\n" % e)
+            self.stopped.wait(self.interval)
+
+    async def run_async(self):
+        """Coroutine version of run(); see the class documentation"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self.changed is None:
+            self.changed = asyncio.Event()
+        wake = asyncio.Event()
+        self.__wake = (loop, wake)
+        self.stopped.clear()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    if await loop.run_in_executor(None, self.check):
+                        self.changed.set()
+                except Exception as e:
+                    sys.stderr.write("Update check failed: %s\n" % e)
+                try:
+                    await asyncio.wait_for(wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.__wake = None
+
+
+class _MockAPI:
+    """Local stand-in for the pinboard.in API, used by bench and the tests
+
+    routes maps a path such as "/v1/posts/all" to a function taking the
+    parsed query and request headers and returning an XML body, or a
+    (status, body) or (status, body, headers) tuple. Every request is
+    recorded in requests.
+    """
+
+    def __init__(self):
+        import http.server
+        import threading
+
+        self.updated = "2020-01-01T00:00:00Z"
+        self.posts = []
+        self.routes = {
+            "/v1/posts/update": self.posts_update,
+            "/v1/posts/all": self.posts_all,
+        }
+        self.requests = []
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                api.requests.append((url.path, query))
+                route = api.routes.get(url.path)
+                if route is None:
+                    self.send_error(404)
+                    return
+                result = route(query, self.headers)
+                if not isinstance(result, tuple):
+                    result = (200, result)
+                status, body, headers = (result + ({},))[:3]
+                if status != 200:
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                data = gzip.compress(body.encode("utf-8"))
+                self.send_response(200)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d/v1" % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def posts_update(self, query, headers):
+        return '<update time="%s"/>' % self.updated
+
+    def posts_all(self, query, headers):
+        start = int(query.get("start", 0))
+        end = start + int(query.get("results", len(self.posts)))
+        return "<posts>%s</posts>" % "".join(self.posts[start:end])
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".pinboard-cache.json")
+
+
+def _post_record(post):
+    """Return a JSON serialisable copy of a post dictionary"""
+    record = {}
+    for name, value in post.items():
+        if name == "time_parsed":
+            continue
+        if name == "tags":
+            value = list(value)
+        record[name] = value
+    return record
+
+
+def _load_cache(path):
+    if not os.path.exists(path):
+        raise PinboardError("No local cache at %s; run 'sync' first" % path)
+    with io.open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_partial(path, last_updated):
+    """Return the posts saved by an interrupted sync, keyed by URL
+
+    Returns None if there is no partial download for this account state.
+    """
+    if not os.path.exists(path):
+        return None
+    posts = {}
+    with io.open(path, "r", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None
+        if not isinstance(header, dict) or header.get("last_updated") != last_updated:
+            return None
+        for line in f:
+            try:
+                post = json.loads(line)
+            except ValueError:
+                # The last line may have been cut short by the interruption.
+                continue
+            posts[post["href"]] = post
+    return posts
+
+
+def _progress(message):
+    sys.stderr.write("\r%s" % message)
+    sys.stderr.flush()
+
+
+def _report(started, account=None):
+    sys.stderr.write("\nFinished in %.2f seconds" % (time.time() - started))
+    if account is not None:
+        stats = account.request_stats
+        sys.stderr.write(
+            "; %d requests, %d throttle sleeps, %d throttled responses, "
+            "%.1f seconds waiting"
+            % (
+                stats["requests"],
+                stats["throttle_sleeps"],
+                stats["throttled"],
+                stats["throttle_seconds"],
+            )
+        )
+    sys.stderr.write(".\n")
+
+
+def _positive_int(value):
+    import argparse
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return number
+
+
+def _open_account(args):
+    token = args.token or os.environ.get("PINBOARD_TOKEN")
+    if not token and not args.username:
+        raise PinboardError("Set --token, PINBOARD_TOKEN or --username/--password")
+    return open(args.username, args.password, token, args.api)
+
+
+def _cmd_sync(args):
+    return _sync(_open_account(args), args.cache, args.window, args.force)
+
+
+def _sync(account, cache, window=DOWNLOAD_WINDOW, force=False, attempts=3):
+    """Mirror the account into the cache file.
+
+    Nothing is downloaded if the cache matches posts/update. Otherwise the
+    whole account is downloaded again, because the API cannot list only the
+    posts changed or deleted since a given time. Each page is appended to a
+    partial file before the download checkpoint moves past it, so an
+    interrupted sync resumes without losing the pages it already fetched.
+    """
+    started = time.time()
+    if not force and os.path.exists(cache):
+        try:
+            data = _load_cache(cache)
+            current = data.get("last_updated") == account["last_updated"]
+            count = len(data["posts"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            sys.stderr.write("Cache is unreadable; downloading again.\n")
+            current = False
+        if current:
+            sys.stderr.write("Cache is up to date (%d posts)." % count)
+            _report(started, account)
+            return 0
+
+    checkpoint = cache + ".checkpoint"
+    partial = cache + ".partial"
+    posts = _load_partial(partial, account["last_updated"])
+    if posts is None:
+        posts = {}
+        for path in (partial, checkpoint):
+            if os.path.exists(path):
+                os.remove(path)
+    elif posts:
+        sys.stderr.write("Resuming sync with %d posts.\n" % len(posts))
+
+    for attempt in range(attempts):
+        try:
+            with io.open(partial, "a", encoding="utf-8") as f:
+                if not f.tell():
+                    f.write(json.dumps({"last_updated": account["last_updated"]}))
+                    f.write("\n")
+                for page in account.paginated_posts(
+                    checkpoint=checkpoint, window=window
+                ):
+                    for post in page:
+                        record = _post_record(post)
+                        posts[record["href"]] = record
+                        f.write(json.dumps(record) + "\n")
+                    f.flush()
+                    _progress("Downloaded %d posts" % len(posts))
+            break
+        except AccountChangedError:
+            sys.stderr.write("\nAccount changed during sync; starting again.\n")
+            account["last_updated"] = account.last_update()
+            os.remove(partial)
+            posts = {}
+    else:
+        raise PinboardError("Account kept changing during sync; try again later")
+
+    data = {"last_updated": account["last_updated"], "posts": list(posts.values())}
+    with io.open(cache + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(cache + ".tmp", cache)
+    os.remove(partial)
+    _report(started, account)
+    return 0
+
+
+def _cmd_watch(args):
+    account = _open_account(args)
+    _sync(account, args.cache, args.window)
+
+    def on_update(updated):
+        account["last_updated"] = updated
+        _sync(account, args.cache, args.window)
+
+    poller = UpdatePoller(account, interval=args.interval, callback=on_update)
+    sys.stderr.write("Polling for updates every %d seconds.\n" % args.interval)
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _cmd_export(args):
+    started = time.time()
+    out = sys.stdout
+    if args.remote:
+        account = _open_account(args)
+        count = 0
+        for page in account.paginated_posts(window=args.window):
+            for post in page:
+                out.write(json.dumps(_post_record(post)) + "\n")
+            count += len(page)
+            _progress("Exported %d posts" % count)
+        _report(started, account)
+    else:
+        posts = _load_cache(args.cache)["posts"]
+        for count, post in enumerate(posts, 1):
+            out.write(json.dumps(post) + "\n")
+            if count % 1000 == 0:
+                _progress("Exported %d posts" % count)
+        _progress("Exported %d posts" % len(posts))
+        _report(started)
+    return 0
+
+
+def _cmd_query(args):
+    started = time.time()
+    text = args.text.lower() if args.text else None
+    matches = 0
+    for post in _load_cache(args.cache)["posts"]:
+        if args.tag and not set(args.tag).issubset(post.get("tags", ())):
+            continue
+        day = post.get("time", "")[:10]
+        if args.fromdt and day < args.fromdt:
+            continue
+        if args.todt and day > args.todt:
+            continue
+        if text and not any(
+            text in post.get(name, "").lower()
+            for name in ("description", "extended", "href")
+        ):
+            continue
+        matches += 1
+        if args.json:
+            sys.stdout.write(json.dumps(post) + "\n")
+        else:
+            sys.stdout.write(
+                "%s  %s  %s\n"
+                % (post.get("time", ""), post.get("href"), post.get("description"))
+            )
+    sys.stderr.write("%d matching posts." % matches)
+    _report(started)
+    return 0
+
+
+def _bench_time(setup, function, repeat):
+    """Return the best time of function(setup()) over repeat runs"""
+    best = None
+    for i in range(repeat):
+        value = setup()
+        began = time.time()
+        function(value)
+        elapsed = time.time() - began
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _bench_row(name, value, baseline, unit):
+    print(
+        "%-26s %9.3f %s  baseline %9.3f %s  (%.2fx)"
+        % (name, value, unit, baseline, unit, baseline / value if value else 0)
+    )
+
+
+def _cmd_bench(args):
+    """Run the performance suite against a local mock of the pinboard.in API
+
+    Each case is compared against the baseline it replaces: paged downloads
+    against a single posts/all request, and TagList tag storage against the
+    plain per-post lists of split strings that posts() used to build. The
+    request throttle's sleep is mocked out so only real work is timed.
+    """
+    import tracemalloc
+    from unittest import mock
+
+    tags = ["tag%d" % i for i in range(args.tags)]
+    api = _MockAPI()
+    for i in range(args.posts):
+        api.posts.append(
+            '<post href="http://example.com/%d" description="Post %d" '
+            'extended="" hash="%032x" meta="%032x" time="2020-01-01T00:00:00Z" '
+            'shared="yes" toread="no" tag="%s %s %s"/>'
+            % (i, i, i, i, tags[i % len(tags)], tags[i * 7 % len(tags)], "common")
+        )
+
+    started = time.time()
+    try:
+        with mock.patch.object(time, "sleep"):
+            result = []
+
+            def account():
+                return open(token="bench:0", api=api.url)
+
+            def single(account):
+                result[:] = account.posts()
+
+            def paged(account):
+                for page in account.paginated_posts(window=args.window):
+                    pass
+
+            _bench_row(
+                "download, paged",
+                _bench_time(account, paged, args.repeat),
+                _bench_time(account, single, args.repeat),
+                "s",
+            )
+
+        tracemalloc.start()
+        baseline = [" ".join(post["tags"]).split(" ") for post in result]
+        baseline_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        vocabulary = TagVocabulary()
+        tracemalloc.start()
+        shared = [TagList(vocabulary, names) for names in baseline]
+        shared_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        _bench_row(
+            "tag storage, TagList",
+            shared_size / 1048576.0,
+            baseline_size / 1048576.0,
+            "MB",
+        )
+
+        def membership(lists):
+            for tag in tags:
+                for names in lists:
+                    tag in names
+
+        _bench_row(
+            "tag membership, TagList",
+            _bench_time(lambda: shared, membership, args.repeat),
+            _bench_time(lambda: baseline, membership, args.repeat),
+            "s",
+        )
+    finally:
+        api.close()
+    _report(started)
+    return 0
+
+
+def main(argv=None):
+    """Command-line interface to a pinboard.in account and its local cache"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="pinboard", description="Mirror and query a pinboard.in account."
+    )
+    parser.add_argument("-v", "--version", action="version", version=__version__)
+    parser.add_argument("--token", help="API token (default: $PINBOARD_TOKEN)")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--api", default=PINBOARD_API, help="API base URL")
+    parser.add_argument(
+        "--cache", default=DEFAULT_CACHE, help="local cache file (%(default)s)"
+    )
+    parser.add_argument("--debug", action="store_true")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    sync = subparsers.add_parser("sync", help="mirror the account into the cache")
+    sync.add_argument("--force", action="store_true", help="download even if unchanged")
+    sync.add_argument("--window", type=_positive_int, default=DOWNLOAD_WINDOW)
+    sync.set_defaults(func=_cmd_sync)
+
+    watch = subparsers.add_parser("watch", help="sync whenever the account changes")
+    watch.add_argument(
+        "--interval", type=_positive_int, default=60, help="seconds per check"
+    )
+    watch.add_argument("--window", type=_positive_int, default=DOWNLOAD_WINDOW)
+    watch.set_defaults(func=_cmd_watch)
+
+    export = subparsers.add_parser("export", help="dump posts as JSON lines")
+    export.add_argument(
+        "--remote", action="store_true", help="stream from the API, not the cache"
+    )
+    export.add_argument("--window", type=_positive_int, default=DOWNLOAD_WINDOW)
+    export.set_defaults(func=_cmd_export)
+
+    query = subparsers.add_parser("query", help="search the local cache")
+    query.add_argument("--tag", action="append", help="required tag (repeatable)")
+    query.add_argument("--from", dest="fromdt", help="earliest date, YYYY-MM-DD")
+    query.add_argument("--to", dest="todt", help="latest date, YYYY-MM-DD")
+    query.add_argument("--text", help="text in description, extended or URL")
+    query.add_argument("--json", action="store_true", help="print JSON lines")
+    query.set_defaults(func=_cmd_query)
+
+    bench = subparsers.add_parser("bench", help="run the performance suite")
+    bench.add_argument("--posts", type=_positive_int, default=20000)
+    bench.add_argument("--tags", type=_positive_int, default=500)
+    bench.add_argument("--window", type=_positive_int, default=5000)
+    bench.add_argument("--repeat", type=_positive_int, default=3)
+    bench.set_defaults(func=_cmd_bench)
+
+    args = parser.parse_args(argv)
+    if args.debug:
+        global _debug
+        _debug = True
+    try:
+        return args.func(args)
+    except (PinboardError, urllib.error.URLError, OSError, ValueError) as e:
+        sys.stderr.write("\npinboard: %s\n" % e)
+        return 1
+
+
 if __name__ == "__main__":
-    if sys.argv[1:]:
-        if sys.argv[1] == "-v" or sys.argv[1] == "--version":
-            print(__version__)
+    sys.exit(main())
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='Python-Pinboard',
     version='1.1',
     description='Python module to access pinboard.in via its API',
     author='Morgan Craft',
-    py_modules=['pinboard'])
+    py_modules=['pinboard'],
+    entry_points={'console_scripts': ['pinboard = pinboard:main']})
@@ -0,0 +1,36 @@
+"""Local mock of the pinboard.in API for the offline unit tests."""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pinboard
+
+
+def post_xml(i, tags="python web", time="2020-01-01T00:00:00Z"):
+    return (
+        '<post href="http://example.com/%d" description="Post %d" extended="" '
+        'hash="%032x" time="%s" shared="yes" toread="no" tag="%s"/>'
+        % (i, i, i, time, tags)
+    )
+
+
+# The same mock server drives "pinboard bench".
+MockAPI = pinboard._MockAPI
+
+
+class MockAPITestCase(unittest.TestCase):
+    """Runs each test against a fresh MockAPI without request throttling"""
+
+    def setUp(self):
+        self.api = MockAPI()
+        self.addCleanup(self.api.close)
+        patch = mock.patch.object(pinboard.time, "sleep")
+        self.sleep = patch.start()
+        self.addCleanup(patch.stop)
+
+    def account(self):
+        return pinboard.open(token="test:0123", api=self.api.url)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""Offline tests for the command-line interface."""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from mock_api import MockAPITestCase, post_xml
+
+import pinboard
+
+
+class TestCommandLine(MockAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.api.posts = [post_xml(i) for i in range(250)]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = os.path.join(directory.name, "cache.json")
+
+    def main(self, *argv):
+        out, err = io.StringIO(), io.StringIO()
+        args = ["--token", "test:0123", "--api", self.api.url, "--cache", self.cache]
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            status = pinboard.main(args + list(argv))
+        return status, out.getvalue(), err.getvalue()
+
+    def cached_hrefs(self):
+        with open(self.cache) as f:
+            return sorted(post["href"] for post in json.load(f)["posts"])
+
+    def test_sync(self):
+        self.assertEqual(self.main("sync", "--window", "100")[0], 0)
+        self.assertEqual(len(self.cached_hrefs()), 250)
+        downloads = len(self.api.requests)
+        status, out, err = self.main("sync")
+        self.assertEqual(status, 0)
+        self.assertIn("up to date", err)
+        self.assertNotIn("/v1/posts/all", [r[0] for r in self.api.requests[downloads:]])
+
+    def test_sync_replaces_unreadable_cache(self):
+        with open(self.cache, "w") as f:
+            f.write("{")
+        status, out, err = self.main("sync")
+        self.assertEqual(status, 0)
+        self.assertIn("downloading again", err)
+        self.assertEqual(len(self.cached_hrefs()), 250)
+
+    def test_interrupted_sync_resumes(self):
+        def posts_all(query, headers):
+            if query.get("start") == "100":
+                return 500, ""
+            return self.api.posts_all(query, headers)
+
+        self.api.routes["/v1/posts/all"] = posts_all
+        status, out, err = self.main("sync", "--window", "100")
+        self.assertEqual(status, 1)
+        self.assertIn("500", err)
+        self.assertFalse(os.path.exists(self.cache))
+
+        self.api.routes["/v1/posts/all"] = self.api.posts_all
+        resumed = len(self.api.requests)
+        self.assertEqual(self.main("sync", "--window", "100")[0], 0)
+        self.assertEqual(
+            self.cached_hrefs(), sorted("http://example.com/%d" % i for i in range(250))
+        )
+        starts = [
+            q.get("start")
+            for path, q in self.api.requests[resumed:]
+            if path.endswith("all")
+        ]
+        self.assertEqual(starts, ["100"])
+        self.assertFalse(os.path.exists(self.cache + ".partial"))
+
+    def test_sync_restarts_when_account_changes(self):
+        def posts_all(query, headers):
+            if query.get("start") == "100" and not changed:
+                changed.append(True)
+                self.api.updated = "2020-02-01T00:00:00Z"
+            return self.api.posts_all(query, headers)
+
+        changed = []
+        self.api.routes["/v1/posts/all"] = posts_all
+        status, out, err = self.main("sync", "--window", "100")
+        self.assertEqual(status, 0)
+        self.assertIn("starting again", err)
+        self.assertEqual(len(self.cached_hrefs()), 250)
+        with open(self.cache) as f:
+            self.assertEqual(json.load(f)["last_updated"], "2020-02-01T00:00:00Z")
+
+    def test_query(self):
+        self.api.posts = [
+            post_xml(0, "python web", "2020-01-05T00:00:00Z"),
+            post_xml(1, "python", "2020-02-05T00:00:00Z"),
+            post_xml(2, "java web", "2020-03-05T00:00:00Z"),
+        ]
+        self.main("sync")
+
+        def hrefs(*argv):
+            status, out, err = self.main("query", "--json", *argv)
+            self.assertEqual(status, 0)
+            return [json.loads(line)["href"] for line in out.splitlines()]
+
+        self.assertEqual(len(hrefs()), 3)
+        self.assertEqual(
+            hrefs("--tag", "python"), ["http://example.com/0", "http://example.com/1"]
+        )
+        self.assertEqual(
+            hrefs("--tag", "python", "--tag", "web"), ["http://example.com/0"]
+        )
+        self.assertEqual(
+            hrefs("--from", "2020-02-01"),
+            ["http://example.com/1", "http://example.com/2"],
+        )
+        self.assertEqual(
+            hrefs("--to", "2020-02-05"),
+            ["http://example.com/0", "http://example.com/1"],
+        )
+        self.assertEqual(hrefs("--text", "POST 2"), ["http://example.com/2"])
+
+    def test_export(self):
+        self.main("sync")
+        status, out, err = self.main("export")
+        self.assertEqual(status, 0)
+        self.assertEqual(len(out.splitlines()), 250)
+
+    def test_errors(self):
+        status, out, err = self.main("query")
+        self.assertEqual(status, 1)
+        self.assertIn("run 'sync' first", err)
+
+        with open(self.cache, "w") as f:
+            f.write("{")
+        self.assertEqual(self.main("query")[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""Offline tests for paginated, checkpointed downloads."""
+
+import json
+import os
+import tempfile
+import unittest
+from time import sleep as real_sleep
+
+from mock_api import MockAPITestCase, post_xml
+
+import pinboard
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestPaginatedPosts(MockAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.api.posts = [post_xml(i) for i in range(250)]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, "checkpoint.json")
+
+    def windows(self):
+        return [
+            int(query["results"])
+            for path, query in self.api.requests
+            if path == "/v1/posts/all"
+        ]
+
+    def hrefs(self, pages):
+        return [post["href"] for page in pages for post in page]
+
+    def test_download_all(self):
+        p = self.account()
+        pages = list(p.paginated_posts(window=100, min_window=100, max_window=100))
+        self.assertEqual([len(page) for page in pages], [100, 100, 50])
+        self.assertEqual(len(set(self.hrefs(pages))), 250)
+
+    def test_checkpoint_resume(self):
+        p = self.account()
+        seen = []
+        with self.assertRaises(Interrupted):
+            for page in p.paginated_posts(
+                checkpoint=self.checkpoint, window=100, max_window=100
+            ):
+                seen.append(page)
+                if len(seen) == 2:
+                    raise Interrupted
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)["start"], 100)
+
+        rest = list(p.paginated_posts(checkpoint=self.checkpoint, window=100))
+        self.assertEqual(self.hrefs(seen[:1] + rest), self.hrefs([p.posts()]))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_checkpoint_ignored_after_update(self):
+        p = self.account()
+        with open(self.checkpoint, "w") as f:
+            json.dump({"start": 200, "window": 100, "last_updated": "old"}, f)
+        pages = list(p.paginated_posts(checkpoint=self.checkpoint, window=100))
+        self.assertEqual(len(self.hrefs(pages)), 250)
+
+    def test_corrupt_checkpoint(self):
+        p = self.account()
+        with open(self.checkpoint, "w") as f:
+            f.write('{"start": 1')
+        pages = list(p.paginated_posts(checkpoint=self.checkpoint, window=100))
+        self.assertEqual(len(self.hrefs(pages)), 250)
+
+    def test_invalid_window(self):
+        p = self.account()
+        with self.assertRaises(ValueError):
+            next(p.paginated_posts(window=0))
+
+    def test_window_grows(self):
+        p = self.account()
+        list(p.paginated_posts(window=25, max_window=100, target_latency=60))
+        self.assertEqual(self.windows(), [25, 50, 100, 100])
+
+    def test_latency_excludes_throttle_sleep(self):
+        self.sleep.side_effect = lambda seconds: real_sleep(0.3)
+        p = self.account()
+        list(p.paginated_posts(window=25, max_window=100, target_latency=0.5))
+        self.assertEqual(self.windows(), [25, 50, 100, 100])
+
+    def test_resumed_window_is_clamped(self):
+        p = self.account()
+        with open(self.checkpoint, "w") as f:
+            json.dump(
+                {"start": 100, "window": 5000, "last_updated": p["last_updated"]}, f
+            )
+        list(p.paginated_posts(checkpoint=self.checkpoint, window=50, max_window=100))
+        self.assertEqual(self.windows(), [100, 100])
+
+    def test_window_shrinks(self):
+        p = self.account()
+        list(p.paginated_posts(window=100, min_window=25, target_latency=0))
+        self.assertEqual(self.windows(), [100, 50, 25, 25, 25, 25, 25])
+
+    def test_throttle_retry(self):
+        throttled = []
+
+        def posts_all(query, headers):
+            if not throttled:
+                throttled.append(query)
+                return 429, ""
+            return self.api.posts_all(query, headers)
+
+        self.api.routes["/v1/posts/all"] = posts_all
+        p = self.account()
+        pages = list(p.paginated_posts(window=200, min_window=50, max_window=200))
+        self.assertEqual(len(self.hrefs(pages)), 250)
+        self.assertEqual(self.windows(), [200, 100, 200])
+        self.assertEqual(p.request_stats["throttled"], 1)
+
+    def test_account_changed(self):
+        p = self.account()
+        pages = p.paginated_posts(checkpoint=self.checkpoint, window=100)
+        next(pages)
+        self.api.updated = "2020-02-01T00:00:00Z"
+        with self.assertRaises(pinboard.AccountChangedError):
+            list(pages)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+
+if __name__ == "__main__":
+    unittest.main()
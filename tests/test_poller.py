@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+"""Offline tests for cheap update checks and the UpdatePoller."""
+
+import asyncio
+import contextlib
+import io
+import threading
+import unittest
+
+from mock_api import MockAPITestCase
+
+import pinboard
+
+
+class TestUpdatePoller(MockAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.api.routes["/v1/posts/update"] = self.update
+
+    def update(self, query, headers):
+        etag = '"%s"' % self.api.updated
+        if headers.get("If-None-Match") == etag:
+            return 304, ""
+        return 200, '<update time="%s"/>' % self.api.updated, {"ETag": etag}
+
+    def update_requests(self):
+        return [r for r in self.api.requests if r[0] == "/v1/posts/update"]
+
+    def test_update_time(self):
+        p = self.account()
+        headers = p["headers"]
+        updated, etag, modified = p.update_time()
+        self.assertEqual(updated, "2020-01-01T00:00:00Z")
+        self.assertEqual(etag, '"2020-01-01T00:00:00Z"')
+        self.assertEqual(p.update_time(etag), (None, etag, None))
+        self.assertIs(p["headers"], headers)
+
+    def test_update_time_spaces_next_request(self):
+        p = self.account()
+        self.sleep.reset_mock()
+        p.update_time()
+        p.last_update()
+        self.assertTrue(self.sleep.called)
+
+    def test_check(self):
+        p = self.account()
+        seen = []
+        poller = pinboard.UpdatePoller(p, callback=seen.append)
+        self.assertFalse(poller.check())
+        self.assertFalse(poller.check())
+        self.api.updated = "2020-02-01T00:00:00Z"
+        self.assertTrue(poller.check())
+        self.assertFalse(poller.check())
+        self.assertEqual(seen, ["2020-02-01T00:00:00Z"])
+        self.assertEqual(poller.last_updated, "2020-02-01T00:00:00Z")
+
+    def test_budget(self):
+        p = self.account()
+        before = len(self.update_requests())
+        poller = pinboard.UpdatePoller(p, budget=2, budget_period=3600)
+        for i in range(5):
+            poller.check()
+        self.assertEqual(len(self.update_requests()) - before, 2)
+
+    def test_failed_callback_is_retried(self):
+        p = self.account()
+        calls = []
+
+        def callback(updated):
+            calls.append(updated)
+            if len(calls) == 1:
+                raise pinboard.PinboardError("sync failed")
+
+        poller = pinboard.UpdatePoller(p, callback=callback)
+        self.api.updated = "2020-02-01T00:00:00Z"
+        with self.assertRaises(pinboard.PinboardError):
+            poller.check()
+        self.assertEqual(poller.last_updated, "2020-01-01T00:00:00Z")
+        self.assertTrue(poller.check())
+        self.assertEqual(calls, ["2020-02-01T00:00:00Z"] * 2)
+
+    def test_run_survives_callback_errors(self):
+        p = self.account()
+        calls = []
+
+        def callback(updated):
+            calls.append(updated)
+            if len(calls) < 3:
+                raise OSError("disk full")
+            poller.stop()
+
+        poller = pinboard.UpdatePoller(p, interval=0.01, callback=callback)
+        self.api.updated = "2020-02-01T00:00:00Z"
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            thread = threading.Thread(target=poller.run)
+            thread.start()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(calls), 3)
+        self.assertIn("disk full", err.getvalue())
+
+    def test_run_async_sets_event(self):
+        p = self.account()
+        poller = pinboard.UpdatePoller(p, interval=0.01)
+
+        async def wait_for_change():
+            task = asyncio.ensure_future(poller.run_async())
+            await asyncio.sleep(0.05)
+            self.assertFalse(poller.changed.is_set())
+            self.api.updated = "2020-02-01T00:00:00Z"
+            await asyncio.wait_for(poller.changed.wait(), 5)
+            poller.stop()
+            await task
+
+        asyncio.run(wait_for_change())
+        self.assertEqual(poller.last_updated, "2020-02-01T00:00:00Z")
+
+    def test_run_async_callbacks_leave_loop_free(self):
+        p = self.account()
+        threads = []
+        poller = pinboard.UpdatePoller(
+            p,
+            interval=60,
+            callback=lambda updated: threads.append(threading.get_ident()),
+        )
+        self.api.updated = "2020-02-01T00:00:00Z"
+
+        async def run_and_stop():
+            task = asyncio.ensure_future(poller.run_async())
+            await asyncio.sleep(0)
+            await asyncio.wait_for(poller.changed.wait(), 5)
+            loop_thread = threading.get_ident()
+            poller.stop()
+            # Stopping must not wait for the 60 second interval.
+            await asyncio.wait_for(task, 5)
+            return loop_thread
+
+        loop_thread = asyncio.run(run_and_stop())
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""Offline tests for the shared tag vocabulary."""
+
+import json
+import unittest
+from array import array
+
+from mock_api import MockAPITestCase, post_xml
+
+import pinboard
+
+
+class TestTagVocabulary(unittest.TestCase):
+    def test_intern(self):
+        v = pinboard.TagVocabulary()
+        self.assertEqual(v.intern("python"), 0)
+        self.assertEqual(v.intern("web"), 1)
+        self.assertEqual(v.intern("python"), 0)
+        self.assertEqual(len(v), 2)
+        self.assertIn("web", v)
+        self.assertIsNone(v.lookup("missing"))
+        self.assertIs(v.shared("py" + "thon"), v.name(0))
+
+    def test_encode_typecode(self):
+        v = pinboard.TagVocabulary()
+        self.assertEqual(v.encode(["a", "b", "a"]), array("H", [0, 1, 0]))
+        for i in range(0x10000):
+            v.intern("tag%d" % i)
+        self.assertEqual(v.encode(["a"]).typecode, "I")
+
+    def test_rename(self):
+        v = pinboard.TagVocabulary()
+        old = v.intern("old")
+        self.assertEqual(v.rename("old", "new"), old)
+        self.assertEqual(v.lookup("new"), old)
+        self.assertIsNone(v.lookup("old"))
+
+    def test_rename_merge(self):
+        v = pinboard.TagVocabulary()
+        old = v.intern("old")
+        new = v.intern("new")
+        self.assertEqual(v.rename("old", "new"), new)
+        self.assertEqual(v.name(old), "new")
+        self.assertEqual(v.lookup("new"), new)
+
+
+class TestTagList(unittest.TestCase):
+    def test_list_compatible(self):
+        v = pinboard.TagVocabulary()
+        tags = pinboard.TagList(v, ["python", "web"])
+        self.assertIsInstance(tags, list)
+        self.assertEqual(tags, ["python", "web"])
+        self.assertEqual(tags, pinboard.TagList(v, ["python", "web"]))
+        self.assertNotEqual(tags, ["web", "python"])
+        self.assertIn("web", tags)
+        self.assertNotIn("java", tags)
+        self.assertEqual(json.dumps(tags), '["python", "web"]')
+        tags.append("java")
+        self.assertEqual(tags.ids, array("H", [0, 1, 2]))
+
+    def test_shared_strings(self):
+        v = pinboard.TagVocabulary()
+        a = pinboard.TagList(v, "python web".split(" "))
+        b = pinboard.TagList(v, "web python".split(" "))
+        self.assertIs(a[0], b[1])
+
+
+class TestAccountTags(MockAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.api.posts = [post_xml(0, "old web"), post_xml(1, "old new")]
+        self.api.routes["/v1/tags/get"] = lambda q, h: (
+            '<tags><tag tag="old" count="2"/><tag tag="new" count="1"/>'
+            '<tag tag="web" count="1"/></tags>'
+        )
+        self.api.routes["/v1/tags/bundles/all"] = lambda q, h: (
+            '<bundles><bundle name="b" tags="old web"/></bundles>'
+        )
+        self.api.routes["/v1/tags/rename"] = lambda q, h: '<result code="done"/>'
+
+    def test_posts_share_tag_strings(self):
+        p = self.account()
+        posts = p.posts()
+        self.assertIs(posts[0]["tags"][0], posts[1]["tags"][0])
+        self.assertEqual(
+            p.bundles()[0]["tag_ids"], p.tag_vocabulary.id_set(["old", "web"])
+        )
+
+    def test_rename_updates_cache(self):
+        p = self.account()
+        posts = p.posts()
+        tags = p.tags()
+        bundles = p.bundles()
+        p.rename_tag("old", "new")
+
+        self.assertEqual(posts[0]["tags"], ["new", "web"])
+        self.assertEqual(posts[1]["tags"], ["new"])
+        self.assertEqual(
+            sorted((t["name"], t["count"]) for t in tags), [("new", 3), ("web", 1)]
+        )
+        self.assertEqual(bundles[0]["tags"], "new web")
+        self.assertEqual(
+            bundles[0]["tag_ids"],
+            frozenset([p.tag_vocabulary.lookup("new"), p.tag_vocabulary.lookup("web")]),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()